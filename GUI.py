@@ -1,21 +1,518 @@
 import sys
 import os
 import json
+import re
+import mmap
+import hashlib
+import codecs
+import time
+import queue
+import threading
+import traceback
+import logging
+import cProfile
+import functools
+from collections import deque, OrderedDict
+from contextlib import contextmanager
 from datetime import datetime
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
                              QTextEdit, QLineEdit, QPushButton, QLabel, QCheckBox, QSpinBox,
-                             QSplitter, QFrame, QMessageBox, QFileDialog, QStatusBar, QComboBox)
-from PyQt5.QtCore import Qt, QThread, pyqtSignal
+                             QSplitter, QFrame, QMessageBox, QFileDialog, QStatusBar, QComboBox,
+                             QDialog, QPlainTextEdit)
+from PyQt5.QtCore import Qt, QThread, QTimer, pyqtSignal
 from PyQt5.QtGui import QFont, QTextCursor, QPalette, QColor
 import requests
 import html
 
+# コードブロックのシンタックスハイライト（pygmentsがインストールされている場合のみ）
+try:
+    from pygments import highlight
+    from pygments.lexers import get_lexer_by_name
+    from pygments.formatters import HtmlFormatter
+    from pygments.util import ClassNotFound
+except ImportError:
+    highlight = None
+
+# 計測モードの設定（環境変数から読み込む）
+# OPENROUTER_PROFILE=1 で計測モードを有効化
+# OPENROUTER_STALL_MS でストール判定のしきい値（ミリ秒）を変更
+# OPENROUTER_CPROFILE にパスを指定すると終了時に cProfile の結果を保存
+PROFILE_ENABLED = os.getenv("OPENROUTER_PROFILE", "") not in ("", "0")
+STALL_THRESHOLD_MS = int(os.getenv("OPENROUTER_STALL_MS", "200"))
+CPROFILE_PATH = os.getenv("OPENROUTER_CPROFILE", "")
+PROFILE_LOG_FILE = "openrouter_profile.log"
+HEARTBEAT_INTERVAL_MS = 50
+
+# ファイル添付の設定
+ATTACHMENT_CHUNK_BYTES = 16 * 1024  # 1チャンクあたりの最大バイト数
+ATTACHMENT_ENCODINGS = ("utf-8", "cp932")  # 添付ファイルの文字コード（先頭から順に試す）
+CHARS_PER_TOKEN = 3  # トークン数の概算に使う1トークンあたりの文字数
+# 添付チャンクの本文と、送信済みチャンクへの参照を表すマーカー
+ATTACHMENT_BODY_PATTERN = re.compile(r"<<添付 ([0-9a-f]+) (.+?) (\d+)/(\d+)>>\n.*?\n<<添付終了 \1>>", re.S)
+ATTACHMENT_REF_PATTERN = re.compile(r"<<添付 ([0-9a-f]+) (.+?) (\d+)/(\d+) 送信済み>>")
+ATTACHMENT_END_PATTERN = re.compile(r"<<添付終了 ([0-9a-f]+)>>")
+# 編集モードで本文の代わりに表示するマーカー（ヘッダー行のみ）
+ATTACHMENT_MARKER_PATTERN = re.compile(r"^<<添付 ([0-9a-f]+) (.+?) (\d+)/(\d+)>>$", re.M)
+
+def estimate_tokens(text):
+    """文字数からトークン数を概算する"""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+# Markdown描画の設定
+RENDER_CACHE_SIZE = 512  # メッセージ単位でキャッシュするHTMLの件数
+RENDER_BLOCK_CACHE_SIZE = 2048  # ブロック単位でキャッシュするHTMLの件数
+STREAM_EMIT_INTERVAL = 0.05  # ストリーミング中に表示を更新する間隔（秒）
+CODE_BLOCK_STYLE = "background-color: #1E1E1E; color: #DCDCDC;"
+INLINE_CODE_STYLE = "background-color: #1E1E1E; color: #F0C674;"
+HEADING_PATTERN = re.compile(r"^(#{1,6})\s+(.*)$")
+HR_PATTERN = re.compile(r"^(-{3,}|\*{3,}|_{3,})$")
+LIST_ITEM_PATTERN = re.compile(r"^\s*([-*+]|\d+[.)])\s+(.*)$")
+TABLE_SEPARATOR_PATTERN = re.compile(r"^\|?\s*:?-+:?\s*(\|\s*:?-+:?\s*)*\|?$")
+INLINE_CODE_PATTERN = re.compile(r"`([^`]+)`")
+BOLD_PATTERN = re.compile(r"\*\*(.+?)\*\*")
+ITALIC_PATTERN = re.compile(r"(?<![*\w])\*(?!\s)(.+?)(?<!\s)\*(?![*\w])")
+LINK_PATTERN = re.compile(r"\[([^\]]+)\]\(([^)\s]+)\)")
+
+def lru_put(cache, key, value, capacity):
+    """OrderedDictにLRU方式で値を追加する"""
+    cache[key] = value
+    cache.move_to_end(key)
+    while len(cache) > capacity:
+        cache.popitem(last=False)
+
+# アシスタントのメッセージをMarkdownとしてHTMLに変換するクラス
+# 描画結果はメッセージ内容のハッシュごとにキャッシュする（複数スレッドから利用可能）
+class MarkdownRenderer:
+    def __init__(self, capacity=RENDER_CACHE_SIZE, block_capacity=RENDER_BLOCK_CACHE_SIZE):
+        self.capacity = capacity
+        self.block_capacity = block_capacity
+        self.cache = OrderedDict()  # メッセージのハッシュ -> HTML
+        self.block_cache = OrderedDict()  # ブロックのテキスト -> HTML
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def content_key(text):
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def cached(self, text):
+        """キャッシュ済みのHTMLを返す（未描画の場合は None）"""
+        key = self.content_key(text.rstrip("\n"))
+        with self.lock:
+            html_text = self.cache.get(key)
+            if html_text is not None:
+                self.cache.move_to_end(key)
+            return html_text
+
+    def render(self, text):
+        text = text.rstrip("\n")
+        key = self.content_key(text)
+        with self.lock:
+            html_text = self.cache.get(key)
+            if html_text is not None:
+                self.cache.move_to_end(key)
+                return html_text
+        html_text = "".join(self.render_block(block) for _, block in self.split_blocks(text))
+        with self.lock:
+            lru_put(self.cache, key, html_text, self.capacity)
+        return html_text
+
+    @staticmethod
+    def split_blocks(text):
+        """テキストをブロック（段落・見出し・コードブロックなど）に分割し、(開始位置, ブロック) の一覧を返す"""
+        blocks = []
+        current = []
+        current_kind = None
+        start = 0
+        pos = 0
+        in_fence = False
+
+        def close():
+            # 末尾の空行を除いて現在のブロックを確定する
+            nonlocal current, current_kind
+            while current and not current[-1].strip():
+                current.pop()
+            if current:
+                blocks.append((start, "".join(current).rstrip("\n")))
+            current = []
+            current_kind = None
+
+        for line in text.splitlines(keepends=True):
+            stripped = line.strip()
+            if in_fence:
+                current.append(line)
+                if stripped.startswith("```"):
+                    # コードブロックの終わり
+                    close()
+                    in_fence = False
+            elif not stripped and current_kind == "list":
+                # 空行を挟んだ箇条書きは、次の行が項目か継続行であれば同じブロックとして扱う
+                current.append(line)
+            elif stripped.startswith("```") or not stripped or HEADING_PATTERN.match(stripped) or HR_PATTERN.match(stripped):
+                # 現在のブロックを区切る
+                close()
+                if stripped.startswith("```"):
+                    start = pos
+                    current = [line]
+                    in_fence = True
+                elif stripped:
+                    # 見出しと区切り線は1行で1ブロック
+                    blocks.append((pos, stripped))
+            else:
+                # 箇条書き・表・引用・段落が切り替わる行で新しいブロックにする
+                kind = MarkdownRenderer.line_kind(line, current_kind)
+                if current and kind != current_kind:
+                    close()
+                if not current:
+                    start = pos
+                    current_kind = kind
+                current.append(line)
+            pos += len(line)
+        close()
+        return blocks
+
+    @staticmethod
+    def line_kind(line, current_kind):
+        """行の種類（list / table / quote / text）を返す"""
+        stripped = line.strip()
+        if LIST_ITEM_PATTERN.match(line):
+            return "list"
+        if stripped.startswith("|"):
+            return "table"
+        if stripped.startswith(">"):
+            return "quote"
+        if current_kind == "list" and line[:1].isspace():
+            # インデントされた行は直前の項目の継続行
+            return "list"
+        return "text"
+
+    def render_block(self, block):
+        with self.lock:
+            html_text = self.block_cache.get(block)
+            if html_text is not None:
+                self.block_cache.move_to_end(block)
+                return html_text
+        html_text = self.convert_block(block)
+        with self.lock:
+            lru_put(self.block_cache, block, html_text, self.block_capacity)
+        return html_text
+
+    def convert_block(self, block):
+        lines = block.split("\n")
+        first = lines[0].strip()
+
+        # コードブロック
+        if first.startswith("```"):
+            body = lines[1:]
+            if body and body[-1].strip().startswith("```"):
+                body = body[:-1]
+            return self.render_code("\n".join(body), first[3:].strip())
+
+        # 見出し
+        match = HEADING_PATTERN.match(first)
+        if match:
+            level = len(match.group(1))
+            return f"<h{level}>{self.render_inline(match.group(2))}</h{level}>"
+
+        # 区切り線
+        if HR_PATTERN.match(first):
+            return "<hr>"
+
+        # 表
+        if len(lines) >= 2 and all(line.strip().startswith("|") for line in lines) \
+                and TABLE_SEPARATOR_PATTERN.match(lines[1].strip()):
+            return self.render_table([lines[0]] + lines[2:])
+
+        # 引用
+        if all(line.lstrip().startswith(">") for line in lines):
+            quoted = [line.lstrip()[1:].strip() for line in lines]
+            return ("<blockquote style='color: #AAAAAA;'>"
+                    + "<br>".join(self.render_inline(line) for line in quoted) + "</blockquote>")
+
+        # 箇条書き
+        if LIST_ITEM_PATTERN.match(lines[0]):
+            return self.render_list(lines)
+
+        # 段落
+        return "<p>" + "<br>".join(self.render_inline(line) for line in lines) + "</p>"
+
+    def render_code(self, code, language):
+        body = None
+        if highlight is not None and language:
+            try:
+                lexer = get_lexer_by_name(language)
+                formatter = HtmlFormatter(nowrap=True, noclasses=True, style="monokai")
+                body = highlight(code, lexer, formatter).rstrip("\n")
+            except ClassNotFound:
+                pass
+        if body is None:
+            body = html.escape(code)
+        return f"<pre style='{CODE_BLOCK_STYLE}'>{body}</pre>"
+
+    def render_list(self, lines):
+        # 項目ごとに (インデント, タグ, テキスト) を取得
+        items = []
+        after_blank = False
+        for line in lines:
+            match = LIST_ITEM_PATTERN.match(line)
+            if not line.strip():
+                after_blank = True
+                continue
+            if match:
+                indent = len(line) - len(line.lstrip())
+                tag = "ol" if match.group(1)[0].isdigit() else "ul"
+                items.append([indent, tag, [match.group(2)]])
+            elif after_blank:
+                # 空行の後の継続行は項目内の新しい段落にする
+                items[-1][2].append(line.strip())
+            else:
+                # 継続行は直前の項目に追加
+                items[-1][2][-1] += " " + line.strip()
+            after_blank = False
+
+        # インデントに応じてリストを入れ子にする
+        parts = []
+        stack = []  # (インデント, タグ)
+        for indent, tag, text in items:
+            while stack and indent < stack[-1][0]:
+                parts.append(f"</li></{stack.pop()[1]}>")
+            if stack and indent == stack[-1][0]:
+                parts.append("</li>")
+            else:
+                parts.append(f"<{tag}>")
+                stack.append((indent, tag))
+            parts.append("<li>" + "<br>".join(self.render_inline(paragraph) for paragraph in text))
+        while stack:
+            parts.append(f"</li></{stack.pop()[1]}>")
+        return "".join(parts)
+
+    def render_table(self, rows):
+        parts = ["<table border='1' cellspacing='0' cellpadding='4' style='border-color: #666666;'>"]
+        for i, row in enumerate(rows):
+            cells = [cell.strip() for cell in row.strip().strip("|").split("|")]
+            tag = "th" if i == 0 else "td"
+            parts.append("<tr>" + "".join(f"<{tag}>{self.render_inline(cell)}</{tag}>" for cell in cells) + "</tr>")
+        parts.append("</table>")
+        return "".join(parts)
+
+    @staticmethod
+    def render_inline(text):
+        # インラインコードは先に退避して、中身に装飾を適用しない
+        codes = []
+
+        def keep_code(match):
+            codes.append(f"<code style='{INLINE_CODE_STYLE}'>{html.escape(match.group(1))}</code>")
+            return f"\x00{len(codes) - 1}\x00"
+
+        text = INLINE_CODE_PATTERN.sub(keep_code, text)
+        text = html.escape(text)
+        text = BOLD_PATTERN.sub(r"<b>\1</b>", text)
+        text = ITALIC_PATTERN.sub(r"<i>\1</i>", text)
+        text = LINK_PATTERN.sub(r"<a href='\2'>\1</a>", text)
+        return re.sub("\x00(\\d+)\x00", lambda match: codes[int(match.group(1))], text)
+
+# ストリーミング中のメッセージを描画するクラス
+# 確定したブロックは一度だけ描画し、以降は末尾のブロックだけを再解析する
+class StreamingMarkdown:
+    def __init__(self, renderer):
+        self.renderer = renderer
+        self.offset = 0  # 未確定部分の開始位置
+
+    def update(self, text):
+        """新たに確定したブロックのHTMLと、末尾ブロックのHTMLを返す"""
+        pending = text[self.offset:]
+        # 受信途中の最終行（"2" や "-" など）で前のブロックを区切らないよう、
+        # 改行まで受信済みの部分だけでブロックを確定する
+        complete = pending[:pending.rfind("\n") + 1]
+        blocks = self.renderer.split_blocks(complete)
+        stable_html = "".join(self.renderer.render_block(block) for _, block in blocks[:-1])
+        tail_start = blocks[-1][0] if blocks else 0
+        self.offset += tail_start
+
+        # 末尾（最後のブロックと受信途中の行）は受信のたびに内容が変わるため、キャッシュせずに描画する
+        tail_html = "".join(self.renderer.convert_block(block)
+                            for _, block in self.renderer.split_blocks(pending[tail_start:]))
+        return stable_html, tail_html
+
+# 会話の再表示に必要なMarkdownの描画を別スレッドで実行するワーカークラス
+class RenderWorker(QThread):
+    rendered = pyqtSignal(int)  # 描画が完了したジョブのIDを返すシグナル
+
+    def __init__(self, renderer):
+        super().__init__()
+        self.renderer = renderer
+        self.jobs = queue.Queue()
+
+    def submit(self, job_id, texts):
+        self.jobs.put((job_id, texts))
+
+    def stop(self):
+        self.jobs.put(None)
+        self.wait()
+
+    def run(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+            job_id, texts = job
+            for text in texts:
+                self.renderer.render(text)
+            self.rendered.emit(job_id)
+
+# 計測ログを画面表示用にメモリ上へ保持するハンドラー
+class MemoryLogHandler(logging.Handler):
+    def __init__(self, capacity=2000):
+        super().__init__()
+        self.records = deque(maxlen=capacity)
+
+    def emit(self, record):
+        self.records.append(self.format(record))
+
+# GUIスレッドのストール検出とハンドラーの処理時間計測を行うクラス
+class PerfMonitor:
+    def __init__(self, enabled, threshold_ms=STALL_THRESHOLD_MS, cprofile_path=""):
+        self.enabled = enabled
+        self.threshold = threshold_ms / 1000.0
+        self.cprofile_path = cprofile_path
+        self.stats = {}  # ハンドラー名 -> [呼び出し回数, 合計秒, 最大秒]
+        self.max_latency = 0.0
+        self.stall_count = 0
+        self.profiler = None
+        self.timer = None
+        self.watchdog = None
+        self.stop_event = threading.Event()
+        self.main_thread_id = threading.get_ident()
+        self.last_beat = time.perf_counter()
+        self.stall_reported = False
+
+        self.logger = logging.getLogger("openrouter.profile")
+        self.memory_handler = MemoryLogHandler()
+        if not self.enabled:
+            return
+
+        formatter = logging.Formatter("%(asctime)s [%(levelname)s] %(message)s")
+        self.memory_handler.setFormatter(formatter)
+        file_handler = logging.FileHandler(PROFILE_LOG_FILE, encoding='utf-8')
+        file_handler.setFormatter(formatter)
+        self.logger.setLevel(logging.INFO)
+        self.logger.addHandler(self.memory_handler)
+        self.logger.addHandler(file_handler)
+        self.logger.propagate = False
+
+    def start(self):
+        """ハートビートタイマーと監視スレッドを開始する（GUIスレッドから呼ぶこと）"""
+        if not self.enabled:
+            return
+        self.main_thread_id = threading.get_ident()
+        self.last_beat = time.perf_counter()
+
+        # イベントループが空いていれば一定間隔で呼ばれるハートビート
+        self.timer = QTimer()
+        self.timer.timeout.connect(self.on_heartbeat)
+        self.timer.start(HEARTBEAT_INTERVAL_MS)
+
+        # GUIスレッドが止まっている間もスタックを取得できるよう別スレッドで監視
+        self.watchdog = threading.Thread(target=self.watch_main_thread, daemon=True)
+        self.watchdog.start()
+
+        if self.cprofile_path:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+        self.logger.info(f"計測モード開始: しきい値 {self.threshold * 1000:.0f}ms")
+
+    def stop(self):
+        """計測を終了し、集計結果と cProfile の結果を出力する"""
+        if not self.enabled:
+            return
+        self.stop_event.set()
+        if self.timer is not None:
+            self.timer.stop()
+        if self.profiler is not None:
+            self.profiler.disable()
+            try:
+                self.profiler.dump_stats(self.cprofile_path)
+                self.logger.info(f"cProfile の結果を {self.cprofile_path} に保存しました")
+            except Exception as e:
+                self.logger.error(f"cProfile の保存に失敗しました: {str(e)}")
+            self.profiler = None
+        self.logger.info("計測モード終了\n" + self.summary())
+
+    def on_heartbeat(self):
+        # 前回のハートビートからの遅延をイベントループの待ち時間として記録
+        now = time.perf_counter()
+        latency = now - self.last_beat - HEARTBEAT_INTERVAL_MS / 1000.0
+        self.last_beat = now
+        self.stall_reported = False
+        if latency > self.max_latency:
+            self.max_latency = latency
+        if latency > self.threshold:
+            self.logger.warning(f"イベントループ遅延: {latency * 1000:.1f}ms")
+
+    def watch_main_thread(self):
+        interval = max(self.threshold / 4, 0.01)
+        while not self.stop_event.wait(interval):
+            stalled = time.perf_counter() - self.last_beat
+            if stalled < self.threshold or self.stall_reported:
+                continue
+            # 1回のストールにつき1度だけGUIスレッドのスタックを記録する
+            self.stall_reported = True
+            self.stall_count += 1
+            frame = sys._current_frames().get(self.main_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame else "（スタックを取得できませんでした）"
+            self.logger.warning(f"GUIスレッドが {stalled * 1000:.0f}ms 以上応答していません:\n{stack}")
+
+    @contextmanager
+    def measure(self, name):
+        """ハンドラーの処理時間を計測する"""
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            entry = self.stats.setdefault(name, [0, 0.0, 0.0])
+            entry[0] += 1
+            entry[1] += elapsed
+            entry[2] = max(entry[2], elapsed)
+            # しきい値を超えた呼び出しだけをログに出力し、それ以外は集計のみ行う
+            if elapsed > self.threshold:
+                self.logger.warning(f"{name}: {elapsed * 1000:.1f}ms")
+
+    def summary(self):
+        lines = [
+            f"最大イベントループ遅延: {self.max_latency * 1000:.1f}ms",
+            f"ストール検出回数: {self.stall_count}",
+            "ハンドラー別処理時間 (回数 / 合計 / 平均 / 最大):"
+        ]
+        for name, (count, total, worst) in sorted(self.stats.items(), key=lambda item: -item[1][1]):
+            lines.append(f"  {name}: {count}回 / {total * 1000:.1f}ms / "
+                         f"{total / count * 1000:.1f}ms / {worst * 1000:.1f}ms")
+        return "\n".join(lines)
+
+    def log_text(self):
+        return self.summary() + "\n\n" + "\n".join(self.memory_handler.records)
+
+def measured(func):
+    """self.perf でメソッドの処理時間を計測するデコレーター"""
+    # clicked(bool) などのシグナルから渡される余分な引数は元のメソッドに渡さない
+    arg_count = func.__code__.co_argcount - 1
+
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        with self.perf.measure(func.__name__):
+            return func(self, *args[:arg_count], **kwargs)
+    return wrapper
+
 # API呼び出しを別スレッドで実行するためのワーカークラス
 class ApiWorker(QThread):
     finished = pyqtSignal(str, str)  # コンテンツと推論プロセスを返すシグナル
+    partial = pyqtSignal(str, str)  # ストリーミング中に確定したブロックと末尾ブロックのHTMLを返すシグナル
     error = pyqtSignal(str)  # エラーメッセージを返すシグナル
 
-    def __init__(self, api_key, messages, use_reasoning, temperature, max_tokens, model):
+    def __init__(self, api_key, messages, use_reasoning, temperature, max_tokens, model, renderer):
         super().__init__()
         self.api_key = api_key
         self.messages = messages
@@ -23,6 +520,7 @@ class ApiWorker(QThread):
         self.temperature = temperature
         self.max_tokens = max_tokens
         self.model = model
+        self.renderer = renderer
         self.url = "https://openrouter.ai/api/v1/chat/completions"
 
     def run(self):
@@ -36,7 +534,8 @@ class ApiWorker(QThread):
                 "model": self.model,
                 "messages": self.messages,
                 "temperature": self.temperature,
-                "max_tokens": self.max_tokens
+                "max_tokens": self.max_tokens,
+                "stream": True  # 応答を逐次表示するためストリーミングで受信
             }
             
             # モデルに応じた推論パラメータの設定
@@ -49,57 +548,166 @@ class ApiWorker(QThread):
                     # Grokモデルの場合
                     data["reasoning"] = {"enabled": True}
             
-            response = requests.post(self.url, headers=headers, json=data, timeout=30)
+            with requests.post(self.url, headers=headers, json=data, timeout=30, stream=True) as response:
             
-            if response.status_code == 200:
-                result = response.json()
-                message_content = result['choices'][0]['message']['content']
+                if response.status_code == 200:
+                    result = self.read_stream(response)
+                    if result is None:
+                        return
+                    message_content = result['choices'][0]['message']['content']
                 
-                # 推論プロセスの取得方法を修正
-                reasoning = ""
-                reasoning_tokens = 0
+                    # 推論プロセスの取得方法を修正
+                    reasoning = ""
+                    reasoning_tokens = 0
                 
-                if self.use_reasoning and ("deepseek" in self.model or "grok" in self.model):
-                    # レスポンスの様々な場所をチェック
-                    message_data = result['choices'][0]['message']
+                    if self.use_reasoning and ("deepseek" in self.model or "grok" in self.model):
+                        # レスポンスの様々な場所をチェック
+                        message_data = result['choices'][0]['message']
                     
-                    # 推論トークン数を取得
-                    usage = result.get('usage', {})
-                    completion_details = usage.get('completion_tokens_details', {})
-                    reasoning_tokens = completion_details.get('reasoning_tokens', 0)
+                        # 推論トークン数を取得
+                        usage = result.get('usage', {})
+                        completion_details = usage.get('completion_tokens_details', {})
+                        reasoning_tokens = completion_details.get('reasoning_tokens', 0)
                     
-                    # DeepSeekモデルの場合の処理
-                    if "deepseek" in self.model:
-                        reasoning = message_data.get('reasoning', '')
-                        if not reasoning:
-                            reasoning = message_data.get('reasoning_content', '')
-                        if not reasoning:
-                            reasoning = message_data.get('reasoning_text', '')
-                        if not reasoning and 'reasoning' in result:
-                            reasoning = result.get('reasoning', '')
+                        # DeepSeekモデルの場合の処理
+                        if "deepseek" in self.model:
+                            reasoning = message_data.get('reasoning', '')
+                            if not reasoning:
+                                reasoning = message_data.get('reasoning_content', '')
+                            if not reasoning:
+                                reasoning = message_data.get('reasoning_text', '')
+                            if not reasoning and 'reasoning' in result:
+                                reasoning = result.get('reasoning', '')
                     
-                    # Grokモデルの場合の処理
-                    elif "grok" in self.model:
-                        reasoning = message_data.get('reasoning', '')
-                        if not reasoning and 'reasoning' in result:
-                            reasoning = result.get('reasoning', '')
+                        # Grokモデルの場合の処理
+                        elif "grok" in self.model:
+                            reasoning = message_data.get('reasoning', '')
+                            if not reasoning and 'reasoning' in result:
+                                reasoning = result.get('reasoning', '')
                     
-                    # 推論トークンが使用されているのにreasoningが空の場合
-                    if not reasoning and reasoning_tokens > 0:
-                        reasoning = f"（推論トークンが {reasoning_tokens} 使用されましたが、推論プロセスは提供されていません）"
+                        # 推論トークンが使用されているのにreasoningが空の場合
+                        if not reasoning and reasoning_tokens > 0:
+                            reasoning = f"（推論トークンが {reasoning_tokens} 使用されましたが、推論プロセスは提供されていません）"
                     
-                    # 推論トークン情報を追加
-                    if reasoning_tokens > 0:
-                        reasoning_header = f"【推論トークン使用量: {reasoning_tokens}】\n\n"
-                        reasoning = reasoning_header + reasoning
+                        # 推論トークン情報を追加
+                        if reasoning_tokens > 0:
+                            reasoning_header = f"【推論トークン使用量: {reasoning_tokens}】\n\n"
+                            reasoning = reasoning_header + reasoning
                 
-                self.finished.emit(message_content, reasoning)
-            else:
-                self.error.emit(f"APIエラー: {response.status_code} - {response.text}")
+                    self.finished.emit(message_content, reasoning)
+                else:
+                    self.error.emit(f"APIエラー: {response.status_code} - {response.text}")
                 
         except Exception as e:
             self.error.emit(f"例外が発生しました: {str(e)}")
 
+    def read_stream(self, response):
+        """ストリーミング応答を受信し、通常の応答と同じ形式の結果を返す（エラー時は None）"""
+        content = ""
+        reasoning = ""
+        usage = {}
+        stream = StreamingMarkdown(self.renderer)
+        last_emit = 0.0
+
+        for line in response.iter_lines():
+            # "data: " 以外の行（コメントや空行）は無視する
+            if not line.startswith(b"data: "):
+                continue
+            payload = line[len(b"data: "):]
+            if payload == b"[DONE]":
+                break
+
+            chunk = json.loads(payload.decode('utf-8'))
+            if "error" in chunk:
+                error = chunk["error"]
+                self.error.emit(f"APIエラー: {error.get('message', error) if isinstance(error, dict) else error}")
+                return None
+
+            usage = chunk.get('usage') or usage
+            choices = chunk.get('choices') or []
+            if choices:
+                delta = choices[0].get('delta', {})
+                content += delta.get('content') or ""
+                reasoning += delta.get('reasoning') or ""
+
+            # 表示の更新は一定間隔ごとに行い、末尾のブロックだけを再描画する
+            now = time.perf_counter()
+            if content and now - last_emit >= STREAM_EMIT_INTERVAL:
+                stable_html, tail_html = stream.update(content)
+                self.partial.emit(stable_html, tail_html)
+                last_emit = now
+
+        # 最終的な表示に使うHTMLをキャッシュしておく（確定済みのブロックはキャッシュから取得される）
+        self.renderer.render(content)
+        return {
+            "choices": [{"message": {"content": content, "reasoning": reasoning}}],
+            "usage": usage
+        }
+
+# 添付ファイルを別スレッドで読み込み、チャンクに分割するワーカークラス
+class FileLoadWorker(QThread):
+    finished = pyqtSignal(list)  # 読み込んだ添付ファイルの一覧を返すシグナル
+    error = pyqtSignal(str)  # エラーメッセージを返すシグナル
+
+    def __init__(self, filenames):
+        super().__init__()
+        self.filenames = filenames
+
+    def run(self):
+        try:
+            attachments = [self.load_file(filename) for filename in self.filenames]
+            self.finished.emit(attachments)
+        except Exception as e:
+            self.error.emit(f"ファイルの読み込み中にエラーが発生しました: {str(e)}")
+
+    def load_file(self, filename):
+        name = os.path.basename(filename)
+        size = os.path.getsize(filename)
+        chunks = []
+        if size > 0:
+            # メモリマップで読み込み、ファイル全体をコピーせずにチャンクへ分割
+            with open(filename, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                if b"\x00" in mm[:8192]:
+                    raise ValueError(f"{name} はテキストファイルではありません")
+                encoding = self.detect_encoding(mm, name)
+                pos = 0
+                while pos < size:
+                    end = min(pos + ATTACHMENT_CHUNK_BYTES, size)
+                    if end < size:
+                        # できるだけ行の区切りで分割する
+                        newline = mm.rfind(b"\n", pos, end)
+                        if newline > pos:
+                            end = newline + 1
+                    # 改行がない場合は文字の途中で切らないよう区切り位置を前にずらす
+                    # （ファイル全体がデコードできることは確認済みのため必ず終了する）
+                    while True:
+                        data = mm[pos:end]
+                        try:
+                            text = data.decode(encoding)
+                            break
+                        except UnicodeDecodeError:
+                            end -= 1
+                    chunks.append({
+                        "hash": hashlib.sha256(data).hexdigest()[:16],
+                        "text": text
+                    })
+                    pos = end
+        return {"name": name, "size": size, "chunks": chunks}
+
+    @staticmethod
+    def detect_encoding(mm, name):
+        """ファイル全体をデコードできる文字コードを返す"""
+        for encoding in ATTACHMENT_ENCODINGS:
+            decoder = codecs.getincrementaldecoder(encoding)()
+            try:
+                for pos in range(0, len(mm), ATTACHMENT_CHUNK_BYTES * 64):
+                    decoder.decode(mm[pos:pos + ATTACHMENT_CHUNK_BYTES * 64])
+                decoder.decode(b"", final=True)
+                return encoding
+            except UnicodeDecodeError:
+                continue
+        raise ValueError(f"{name} の文字コードを判別できません（対応: {' / '.join(ATTACHMENT_ENCODINGS)}）")
+
 # メインアプリケーションウィンドウ
 class OpenRouterChatApp(QMainWindow):
     def __init__(self):
@@ -108,7 +716,21 @@ class OpenRouterChatApp(QMainWindow):
         self.conversation_history = []
         self.session_start = datetime.now()
         self.is_editing = False  # 編集モードかどうか
+        self.pending_attachments = []  # 次のメッセージで送信する添付ファイル
+        self.sent_chunks = set()  # 会話内で送信済みのチャンクのハッシュ
+        self.edit_attachments = {}  # 編集中に本文を省略した添付チャンク（ハッシュ -> 本文）
+        self.perf = PerfMonitor(PROFILE_ENABLED, STALL_THRESHOLD_MS, CPROFILE_PATH)  # 計測モード
+        self.renderer = MarkdownRenderer()  # アシスタントのメッセージの描画
+        self.stream_anchor = None  # ストリーミング表示中のメッセージの開始位置
+        self.stream_pos = 0  # ストリーミング表示中の末尾ブロックの開始位置
+        self.stream_stable_html = ""  # ストリーミング中に確定したブロックのHTML
+        self.render_job_id = 0
+        self.render_callbacks = {}  # 描画ジョブのID -> 描画完了後に呼ぶ処理
+        self.render_worker = RenderWorker(self.renderer)
+        self.render_worker.rendered.connect(self.handle_rendered)
+        self.render_worker.start()
         self.init_ui()
+        self.perf.start()
         
     def init_ui(self):
         self.setWindowTitle("OpenRouter Chat - PyQt5")
@@ -174,6 +796,12 @@ class OpenRouterChatApp(QMainWindow):
 
         self.message_input.setStyleSheet(input_style)
         input_layout.addWidget(self.message_input)
+
+        # 添付ファイルのプレビュー（サイズとトークン数の概算）
+        self.attachment_label = QLabel()
+        self.attachment_label.setWordWrap(True)
+        self.attachment_label.setVisible(False)
+        input_layout.addWidget(self.attachment_label)
         
         # 設定パネル
         settings_layout = QHBoxLayout()
@@ -227,6 +855,17 @@ class OpenRouterChatApp(QMainWindow):
         self.send_button.clicked.connect(self.send_message)
         button_layout.addWidget(self.send_button)
 
+        # ファイル添付ボタン
+        self.attach_button = QPushButton("ファイル添付")
+        self.attach_button.clicked.connect(self.attach_files)
+        button_layout.addWidget(self.attach_button)
+
+        # 添付解除ボタン
+        self.clear_attachments_button = QPushButton("添付を解除")
+        self.clear_attachments_button.clicked.connect(self.clear_attachments)
+        self.clear_attachments_button.setEnabled(False)
+        button_layout.addWidget(self.clear_attachments_button)
+
         self.clear_button = QPushButton("会話をクリア")
         self.clear_button.clicked.connect(self.clear_conversation)
         button_layout.addWidget(self.clear_button)
@@ -246,6 +885,12 @@ class OpenRouterChatApp(QMainWindow):
         self.edit_button.setCheckable(True)  # トグルボタンとして設定
         button_layout.addWidget(self.edit_button)
 
+        # 計測ログ表示ボタン（計測モード時のみ表示）
+        self.profile_button = QPushButton("計測ログ")
+        self.profile_button.clicked.connect(self.show_profile_log)
+        self.profile_button.setVisible(self.perf.enabled)
+        button_layout.addWidget(self.profile_button)
+
         # ボタンのスタイルを設定
         button_style = """
             QPushButton {
@@ -273,18 +918,24 @@ class OpenRouterChatApp(QMainWindow):
         """
 
         self.send_button.setStyleSheet(button_style)
+        self.attach_button.setStyleSheet(button_style)
+        self.clear_attachments_button.setStyleSheet(button_style)
         self.clear_button.setStyleSheet(button_style)
         self.save_button.setStyleSheet(button_style)
         self.load_button.setStyleSheet(button_style)
         self.edit_button.setStyleSheet(button_style)
+        self.profile_button.setStyleSheet(button_style)
 
         # フォントも設定（日本語表示用）
         font = QFont("MS UI Gothic", 9)
         self.send_button.setFont(font)
+        self.attach_button.setFont(font)
+        self.clear_attachments_button.setFont(font)
         self.clear_button.setFont(font)
         self.save_button.setFont(font)
         self.load_button.setFont(font)
         self.edit_button.setFont(font)
+        self.profile_button.setFont(font)
 
         input_layout.addLayout(button_layout)
         
@@ -324,21 +975,29 @@ class OpenRouterChatApp(QMainWindow):
             self.reasoning_text.setVisible(False)
             self.statusBar().showMessage(f"{model_name.split('/')[0]}モデル: 推論機能は利用できません")
     
+    @measured
     def toggle_edit_mode(self):
         # 編集モードの切り替え
         self.is_editing = not self.is_editing
         self.conversation_text.setReadOnly(not self.is_editing)
         
         if self.is_editing:
+            # 編集用のテキストに置き換えるため、ストリーミング表示の位置は無効になる
+            self.stream_anchor = None
             self.edit_button.setText("編集終了")
             self.statusBar().showMessage("編集モード: 会話内容を直接編集できます")
             
             # --- 修正箇所 ---
             # conversation_history から安定したプレーンテキストを作成して編集用にする
             parts = []
+            self.edit_attachments = {}
             for msg in self.conversation_history:
                 role = msg.get("role", "")
                 content = msg.get("content", "")
+                # 添付チャンクの本文はマーカーだけを表示し、編集終了時に復元する
+                for match in ATTACHMENT_BODY_PATTERN.finditer(content):
+                    self.edit_attachments[match.group(1)] = match.group(0)
+                content = ATTACHMENT_BODY_PATTERN.sub(lambda m: m.group(0).split("\n", 1)[0], content)
                 if role == "user":
                     label = "あなた:"
                 elif role == "assistant":
@@ -361,6 +1020,7 @@ class OpenRouterChatApp(QMainWindow):
             self.update_conversation_from_edit()
 
     
+    @measured
     def update_conversation_from_edit(self):
         # 編集された内容を会話履歴に反映
         edited_text = self.conversation_text.toPlainText()
@@ -393,30 +1053,22 @@ class OpenRouterChatApp(QMainWindow):
         # 最後のメッセージを追加
         if current_role is not None and current_content:
             new_history.append({"role": current_role, "content": "\n".join(current_content)})
+
+        # マーカーに置き換えていた添付チャンクの本文を復元
+        for message in new_history:
+            message["content"] = ATTACHMENT_MARKER_PATTERN.sub(
+                lambda m: self.edit_attachments.get(m.group(1), m.group(0)), message["content"])
+        self.edit_attachments = {}
         
         # 会話履歴を更新
         self.conversation_history = new_history
+        self.rebuild_sent_chunks()
         
-        # HTML形式で再表示
-        self.conversation_text.clear()
-        for message in self.conversation_history:
-            role = message.get("role", "")
-            content = message.get("content", "")
-            
-            if role == "user":
-                self.append_to_conversation("あなた", content, False)
-            elif role == "assistant":
-                # モデル名に応じて表示名を変更
-                model_name = self.model_combo.currentText()
-                if "deepseek" in model_name:
-                    self.append_to_conversation("DeepSeek", content, False)
-                elif "grok" in model_name:
-                    self.append_to_conversation("Grok", content, False)
-                else:
-                    self.append_to_conversation("アシスタント", content, False)
-            elif role == "system":
-                self.append_to_conversation("システム", content, False)
+        # HTML形式で再表示（Markdownの描画は別スレッドで行う）
+        model_name = self.model_combo.currentText()
+        self.render_conversation(lambda: self.redraw_conversation(model_name))
     
+    @measured
     def send_message(self):
         # 編集モードの場合は終了する
         if self.is_editing:
@@ -424,11 +1076,16 @@ class OpenRouterChatApp(QMainWindow):
         
         # QTextEditからテキストを取得
         message = self.message_input.toPlainText().strip()
-        if not message:
+        if not message and not self.pending_attachments:
             return
             
         # 入力欄をクリア
         self.message_input.clear()
+
+        # 添付ファイルがあればメッセージに追加（送信済みのチャンクは参照のみ）
+        if self.pending_attachments:
+            message = self.build_attachment_message(message)
+            self.clear_attachments()
         
         # 会話履歴に追加
         self.conversation_history.append({"role": "user", "content": message})
@@ -447,8 +1104,12 @@ class OpenRouterChatApp(QMainWindow):
             self.reasoning_checkbox.isChecked(),
             self.temperature_spin.value() / 10.0,  # 0.1単位で設定
             self.max_tokens_spin.value(),
-            self.model_combo.currentText()  # 選択されたモデルを渡す
+            self.model_combo.currentText(),  # 選択されたモデルを渡す
+            self.renderer
         )
+        self.stream_anchor = None
+        self.stream_stable_html = ""
+        self.worker.partial.connect(self.handle_api_partial)
         self.worker.finished.connect(self.handle_api_response)
         self.worker.error.connect(self.handle_api_error)
         self.worker.start()
@@ -456,18 +1117,17 @@ class OpenRouterChatApp(QMainWindow):
         # 送信ボタンを無効化
         self.send_button.setEnabled(False)
     
+    @measured
     def handle_api_response(self, content, reasoning):
         # 会話履歴に追加
         self.conversation_history.append({"role": "assistant", "content": content})
+
+        # ストリーミング表示を、キャッシュ済みの描画結果で置き換える
+        self.remove_stream_display()
         
         # モデル名に応じて表示名を変更
         model_name = self.model_combo.currentText()
-        if "deepseek" in model_name:
-            self.append_to_conversation("DeepSeek", content)
-        elif "grok" in model_name:
-            self.append_to_conversation("Grok", content)
-        else:
-            self.append_to_conversation("アシスタント", content)
+        self.append_to_conversation(self.assistant_sender(model_name), content)
         
         # 推論表示エリアを更新（DeepSeekまたはGrokモデルの場合のみ）
         if reasoning:
@@ -486,7 +1146,48 @@ class OpenRouterChatApp(QMainWindow):
         # 送信ボタンを再有効化
         self.send_button.setEnabled(True)
     
+    @measured
+    def handle_api_partial(self, stable_html, tail_html):
+        self.stream_stable_html += stable_html
+
+        # 編集モード中は表示を更新しない（応答完了時に反映される）
+        if self.is_editing:
+            return
+
+        cursor = self.conversation_text.textCursor()
+        if self.stream_anchor is None:
+            # 応答の最初の部分を受信したとき（または再表示後）は送信者名と確定済みのブロックを表示
+            cursor.movePosition(QTextCursor.End)
+            self.stream_anchor = cursor.position()
+            cursor.insertHtml(self.sender_prefix(self.assistant_sender(self.model_combo.currentText())))
+            if self.stream_stable_html:
+                cursor.insertHtml(self.stream_stable_html)
+            self.stream_pos = cursor.position()
+        else:
+            # 前回の末尾ブロックを削除し、新たに確定したブロックを追加
+            cursor.setPosition(self.stream_pos)
+            cursor.movePosition(QTextCursor.End, QTextCursor.KeepAnchor)
+            cursor.removeSelectedText()
+            if stable_html:
+                cursor.insertHtml(stable_html)
+                self.stream_pos = cursor.position()
+        cursor.insertHtml(tail_html)
+        self.conversation_text.ensureCursorVisible()
+
+    def remove_stream_display(self):
+        # ストリーミング中に表示した内容を削除
+        if self.stream_anchor is None:
+            return
+        cursor = self.conversation_text.textCursor()
+        cursor.setPosition(self.stream_anchor)
+        cursor.movePosition(QTextCursor.End, QTextCursor.KeepAnchor)
+        cursor.removeSelectedText()
+        self.stream_anchor = None
+
     def handle_api_error(self, error_message):
+        # 途中まで受信した応答の表示を削除
+        self.remove_stream_display()
+
         # エラーメッセージを表示
         self.append_to_conversation("システム", f"エラー: {error_message}")
         
@@ -496,16 +1197,29 @@ class OpenRouterChatApp(QMainWindow):
         # 送信ボタンを再有効化
         self.send_button.setEnabled(True)
     
-    def append_to_conversation(self, sender, message, scroll=True, add_separator=False):
+    def assistant_sender(self, model_name):
+        # モデル名に応じたアシスタントの表示名
+        if "deepseek" in model_name:
+            return "DeepSeek"
+        elif "grok" in model_name:
+            return "Grok"
+        else:
+            return "アシスタント"
+
+    def sender_prefix(self, sender):
         # 送信者に応じて色を変更
         if sender == "あなた":
-            prefix = "<font color='lightblue'><b>あなた:</b></font> "
+            return "<font color='lightblue'><b>あなた:</b></font> "
         elif sender == "DeepSeek":
-            prefix = "<font color='lightgreen'><b>DeepSeek:</b></font> "
+            return "<font color='lightgreen'><b>DeepSeek:</b></font> "
         elif sender == "Grok":
-            prefix = "<font color='orange'><b>Grok:</b></font> "
+            return "<font color='orange'><b>Grok:</b></font> "
         else:
-            prefix = "<font color='salmon'><b>システム:</b></font> "
+            return "<font color='salmon'><b>システム:</b></font> "
+
+    @measured
+    def append_to_conversation(self, sender, message, scroll=True, add_separator=False):
+        prefix = self.sender_prefix(sender)
 
         cursor = self.conversation_text.textCursor()
         cursor.movePosition(QTextCursor.End)
@@ -514,10 +1228,24 @@ class OpenRouterChatApp(QMainWindow):
         if add_separator and self.conversation_text.toPlainText():
             cursor.insertHtml("<br><br>")
 
+        # 添付チャンクの本文は表示せず、ファイル名だけを表示する
+        message = ATTACHMENT_BODY_PATTERN.sub(
+            lambda m: f"[添付] {m.group(2)} ({m.group(3)}/{m.group(4)})", message)
+        message = ATTACHMENT_REF_PATTERN.sub(
+            lambda m: f"[添付] {m.group(2)} ({m.group(3)}/{m.group(4)}, 送信済み)", message)
+
         # メッセージ末尾の余分な改行を削る
         cleaned = message.rstrip("\n")
-        escaped = html.escape(cleaned).replace("\n", "<br>")
-        cursor.insertHtml(prefix + escaped)
+
+        # アシスタントのメッセージは描画済みのMarkdownを使う（未描画の場合はそのまま表示）
+        rendered = None
+        if sender in ("DeepSeek", "Grok", "アシスタント"):
+            rendered = self.renderer.cached(cleaned)
+        if rendered is not None:
+            cursor.insertHtml(prefix + rendered)
+        else:
+            escaped = html.escape(cleaned).replace("\n", "<br>")
+            cursor.insertHtml(prefix + escaped)
 
         # --- ★ ここを追加 → 最後に1行だけ空行を追加 ---
         # 編集モードでは追加しない（表示崩れ防止）
@@ -529,6 +1257,132 @@ class OpenRouterChatApp(QMainWindow):
             self.conversation_text.ensureCursorVisible()
 
     
+    def render_conversation(self, callback):
+        # 未描画のアシスタントのメッセージを別スレッドで描画してから callback を呼ぶ
+        texts = [message.get("content", "") for message in self.conversation_history
+                 if message.get("role") == "assistant"]
+        missing = [text for text in texts if self.renderer.cached(text) is None]
+        if not missing:
+            callback()
+            return
+        self.render_job_id += 1
+        self.render_callbacks[self.render_job_id] = callback
+        self.statusBar().showMessage("会話を描画しています...")
+        self.render_worker.submit(self.render_job_id, missing)
+
+    def handle_rendered(self, job_id):
+        callback = self.render_callbacks.pop(job_id, None)
+        if callback is not None:
+            callback()
+
+    @measured
+    def redraw_conversation(self, model_name):
+        # 編集中は編集終了時に再表示されるため何もしない
+        if self.is_editing:
+            return
+
+        self.stream_anchor = None
+        self.conversation_text.clear()
+        for message in self.conversation_history:
+            role = message.get("role", "")
+            content = message.get("content", "")
+
+            if role == "user":
+                self.append_to_conversation("あなた", content, False)
+            elif role == "assistant":
+                # モデル名に応じて表示名を変更
+                self.append_to_conversation(self.assistant_sender(model_name), content, False)
+            elif role == "system":
+                self.append_to_conversation("システム", content, False)
+
+        # 最後にスクロール
+        self.conversation_text.ensureCursorVisible()
+
+    def attach_files(self):
+        # ファイル選択ダイアログを表示
+        options = QFileDialog.Options()
+        filenames, _ = QFileDialog.getOpenFileNames(
+            self, "ファイルを添付", "",
+            "All Files (*)", options=options)
+
+        if filenames:
+            # ファイルの読み込みとチャンク分割を別スレッドで実行
+            self.attach_button.setEnabled(False)
+            self.statusBar().showMessage("ファイルを読み込んでいます...")
+            self.file_worker = FileLoadWorker(filenames)
+            self.file_worker.finished.connect(self.handle_files_loaded)
+            self.file_worker.error.connect(self.handle_file_error)
+            self.file_worker.start()
+
+    @measured
+    def handle_files_loaded(self, attachments):
+        # 空のファイルは送信する内容がないため添付しない
+        empty_names = [attachment["name"] for attachment in attachments if not attachment["chunks"]]
+        attachments = [attachment for attachment in attachments if attachment["chunks"]]
+        self.pending_attachments.extend(attachments)
+        self.update_attachment_preview()
+        self.attach_button.setEnabled(True)
+        status = f"{len(attachments)} 個のファイルを添付しました"
+        if empty_names:
+            status += f"（空のファイルをスキップ: {', '.join(empty_names)}）"
+        self.statusBar().showMessage(status)
+
+    def handle_file_error(self, error_message):
+        self.attach_button.setEnabled(True)
+        self.statusBar().showMessage(f"エラー: {error_message}")
+        QMessageBox.critical(self, "添付エラー", error_message)
+
+    def clear_attachments(self):
+        self.pending_attachments = []
+        self.update_attachment_preview()
+
+    def update_attachment_preview(self):
+        # 送信前に添付ファイルのサイズと新規送信分のトークン数を表示
+        if not self.pending_attachments:
+            self.attachment_label.clear()
+            self.attachment_label.setVisible(False)
+            self.clear_attachments_button.setEnabled(False)
+            return
+
+        lines = []
+        seen = set(self.sent_chunks)
+        total_tokens = 0
+        for attachment in self.pending_attachments:
+            new_chunks = [chunk for chunk in attachment["chunks"] if chunk["hash"] not in seen]
+            seen.update(chunk["hash"] for chunk in new_chunks)
+            tokens = sum(estimate_tokens(chunk["text"]) for chunk in new_chunks)
+            total_tokens += tokens
+            lines.append(f"{attachment['name']}: {attachment['size'] / 1024:.1f} KB, "
+                         f"{len(attachment['chunks'])} チャンク（新規 {len(new_chunks)}）, "
+                         f"約 {tokens} トークン")
+        lines.append(f"添付の送信量: 約 {total_tokens} トークン")
+        self.attachment_label.setText("\n".join(lines))
+        self.attachment_label.setVisible(True)
+        self.clear_attachments_button.setEnabled(True)
+
+    def build_attachment_message(self, message):
+        # 未送信のチャンクは本文を含め、送信済みのチャンクはハッシュで参照する
+        parts = [message] if message else []
+        for attachment in self.pending_attachments:
+            count = len(attachment["chunks"])
+            for i, chunk in enumerate(attachment["chunks"], 1):
+                header = f"<<添付 {chunk['hash']} {attachment['name']} {i}/{count}"
+                if chunk["hash"] in self.sent_chunks:
+                    parts.append(f"{header} 送信済み>>")
+                else:
+                    text = chunk["text"].rstrip("\n")
+                    parts.append(f"{header}>>\n{text}\n<<添付終了 {chunk['hash']}>>")
+                    self.sent_chunks.add(chunk["hash"])
+        return "\n\n".join(parts)
+
+    def rebuild_sent_chunks(self):
+        # 会話履歴に含まれるチャンク本文から送信済みチャンクを再構築
+        self.sent_chunks = set()
+        for message in self.conversation_history:
+            self.sent_chunks.update(ATTACHMENT_END_PATTERN.findall(message.get("content", "")))
+        # 添付待ちのファイルの新規チャンク数とトークン数を更新
+        self.update_attachment_preview()
+
     def clear_conversation(self):
         # 編集モードの場合は終了する
         if self.is_editing:
@@ -536,6 +1390,9 @@ class OpenRouterChatApp(QMainWindow):
             
         # 会話履歴と表示をクリア
         self.conversation_history = []
+        self.sent_chunks = set()
+        self.update_attachment_preview()
+        self.stream_anchor = None
         self.conversation_text.clear()
         self.reasoning_text.clear()
         self.statusBar().showMessage("会話をクリアしました")
@@ -565,7 +1422,8 @@ class OpenRouterChatApp(QMainWindow):
                 }
                 
                 # JSONファイルに保存
-                with open(filename, 'w', encoding='utf-8') as f:
+                # ダイアログでの操作時間を含めないよう、ファイル書き込みだけを計測
+                with open(filename, 'w', encoding='utf-8') as f, self.perf.measure("save_conversation"):
                     json.dump(data, f, ensure_ascii=False, indent=2)
                 
                 self.statusBar().showMessage(f"会話を {filename} に保存しました")
@@ -587,44 +1445,47 @@ class OpenRouterChatApp(QMainWindow):
         if filename:
             try:
                 # JSONファイルから読み込み
-                with open(filename, 'r', encoding='utf-8') as f:
+                # ダイアログでの操作時間を含めないよう、JSONの解析だけを計測（再表示は redraw_conversation で計測）
+                with open(filename, 'r', encoding='utf-8') as f, self.perf.measure("load_conversation"):
                     data = json.load(f)
                 
                 # 会話履歴を復元
                 self.conversation_history = data.get("conversation", [])
+                self.rebuild_sent_chunks()
                 
                 # モデル情報があれば復元
                 saved_model = data.get("model", "")
                 if saved_model and saved_model in [self.model_combo.itemText(i) for i in range(self.model_combo.count())]:
                     self.model_combo.setCurrentText(saved_model)
                 
-                # 会話表示を更新
-                self.conversation_text.clear()
-                for message in self.conversation_history:
-                    role = message.get("role", "")
-                    content = message.get("content", "")
-                    
-                    if role == "user":
-                        self.append_to_conversation("あなた", content, False)
-                    elif role == "assistant":
-                        # 保存時のモデルに応じて表示名を変更
-                        if "deepseek" in saved_model:
-                            self.append_to_conversation("DeepSeek", content, False)
-                        elif "grok" in saved_model:
-                            self.append_to_conversation("Grok", content, False)
-                        else:
-                            self.append_to_conversation("アシスタント", content, False)
-                    elif role == "system":
-                        self.append_to_conversation("システム", content, False)
-                
-                # 最後にスクロール
-                self.conversation_text.ensureCursorVisible()
-                
-                self.statusBar().showMessage(f"会話を {filename} から読み込みました")
+                # 会話表示を更新（保存時のモデルに応じて表示名を変更）
+                status_message = f"会話を {filename} から読み込みました"
+
+                def redraw():
+                    self.redraw_conversation(saved_model)
+                    self.statusBar().showMessage(status_message)
+
+                self.render_conversation(redraw)
                 
             except Exception as e:
                 QMessageBox.critical(self, "読み込みエラー", f"ファイルの読み込み中にエラーが発生しました: {str(e)}")
     
+    def show_profile_log(self):
+        # 計測ログを読み取り専用のダイアログで表示
+        dialog = QDialog(self)
+        dialog.setWindowTitle("計測ログ")
+        dialog.resize(800, 500)
+        layout = QVBoxLayout(dialog)
+
+        log_view = QPlainTextEdit()
+        log_view.setReadOnly(True)
+        log_view.setFont(QFont("Courier New", 9))
+        log_view.setPlainText(self.perf.log_text())
+        log_view.moveCursor(QTextCursor.End)
+        layout.addWidget(log_view)
+
+        dialog.exec_()
+
     def closeEvent(self, event):
         # 編集モードの場合は終了する
         if self.is_editing:
@@ -675,8 +1536,12 @@ class OpenRouterChatApp(QMainWindow):
         
         if result == QMessageBox.Yes:
             self.save_conversation()
+            self.render_worker.stop()
+            self.perf.stop()
             event.accept()
         elif result == QMessageBox.No:
+            self.render_worker.stop()
+            self.perf.stop()
             event.accept()
         else:
             event.ignore()